@@ -5,63 +5,207 @@ import numpy as np
 from PyQt5 import QtWidgets, QtCore
 import pyqtgraph as pg
 import time
-from collections import deque
+from functools import lru_cache
 from scipy import signal
 
 # Constants
 SAMPLE_RATE = 250  # Hz
 DISPLAY_TIME_SECONDS = 6
 MAX_POINTS = SAMPLE_RATE * DISPLAY_TIME_SECONDS
-UPDATE_INTERVAL_MS = 15  # 
+SAMPLE_DTYPE = np.uint16  # 12-bit ADC readings
+READ_CHUNK_SIZE = 4096  # bytes
+READ_INTERVAL_MS = 5  # Poll interval when no serial data is waiting
+REDRAW_INTERVAL_MS = 33  # ~30 Hz, samples are read by SerialReader
 FILTER_SIZE = 25  # For baseline removal
 MIN_HEART_RATE = 40
 MAX_HEART_RATE = 200
+INTEGRATION_WINDOW_SECONDS = 0.15  # QRS moving window integration
+HEART_RATE_HISTORY = 5  # Readings averaged for display
+PICO_VID = 0x2E8A
+PICO_PIDS = (0x000A, 0x0003)
 
-def find_pico_port():
+def find_pico_port(ports=None):
     """Find the Raspberry Pi Pico's port"""
-    ports = list(serial.tools.list_ports.comports())
+    if ports is None:
+        ports = list(serial.tools.list_ports.comports())
     
     for port in ports:
-        if any(id in str(port) for id in ["2E8A:000A", "2E8A:0003", "USB Serial Device"]):
+        if port.vid == PICO_VID and port.pid in PICO_PIDS:
+            return port.device
+    
+    # Fall back to the generic CDC description when the VID/PID isn't reported
+    for port in ports:
+        if port.description and "USB Serial Device" in port.description:
             return port.device
     
     return ports[0].device if ports else None
 
-def pan_tompkins_detect(data, sample_rate=250):
+def parse_samples(raw):
+    """Parse newline separated integer samples from raw serial bytes"""
+    # np.fromstring parses whitespace-only input (e.g. a lone b'\r\n') as [0]
+    if raw.isspace():
+        return np.empty(0, dtype=np.int32)
+    try:
+        return np.fromstring(raw, dtype=np.int32, sep='\n')
+    except ValueError:
+        # Non-numeric lines (e.g. the Pico start-up banner), parse line by line
+        values = []
+        for line in raw.split(b'\n'):
+            try:
+                values.append(int(line))
+            except ValueError:
+                continue
+        return np.array(values, dtype=np.int32)
+
+def moving_average(x, k, out=None, work=None):
+    """Moving average of x over k samples, same as np.convolve(x, np.ones(k)/k, mode='same')
+
+    out may alias x; work, if given, is a float64 scratch of at least len(x) + k values.
+    """
+    # Zero pad like the 'same' convolution, then take windowed sums off a cumulative sum
+    n = len(x)
+    left = k // 2
+    padded = np.empty(n + k, dtype=np.float64) if work is None else work[:n + k]
+    padded[:left + 1] = 0
+    np.cumsum(x, out=padded[left + 1:left + 1 + n])
+    padded[left + 1 + n:] = padded[left + n]
+    out = np.subtract(padded[k:], padded[:-k], out=out)
+    out *= 1.0 / k
+    return out
+
+@lru_cache(maxsize=None)
+def bandpass_coefficients(sample_rate):
+    """Butterworth bandpass (5-15 Hz) used for QRS detection"""
+    nyquist = sample_rate / 2
+    low = 5 / nyquist
+    high = 15 / nyquist
+    return signal.butter(4, [low, high], btype='band')
+
+def pan_tompkins_detect(data, sample_rate=250, scratch=None, work=None):
+    """Find R-peaks in data, reusing the scratch/work float64 buffers when given"""
     if len(data) < sample_rate:  # Need at least 1 second of data
         return []
     
     # Bandpass filter (5-15 Hz)
-    nyquist = sample_rate / 2
-    low = 5 / nyquist
-    high = 15 / nyquist
-    b, a = signal.butter(4, [low, high], btype='band')
-    filtered = signal.filtfilt(b, a, data)
+    b, a = bandpass_coefficients(sample_rate)
+    # filtfilt pads in the input dtype, so unsigned samples must be converted first
+    filtered = signal.filtfilt(b, a, np.asarray(data, dtype=np.float64))
     
     # Derivative for QRS detection
-    derivative = np.diff(filtered)
-    squared = derivative ** 2
+    n = len(filtered) - 1
+    derivative = np.subtract(filtered[1:], filtered[:-1], out=None if scratch is None else scratch[:n])
+    squared = np.square(derivative, out=derivative)
+    
+    # moving average integration, in place
+    window_size = int(INTEGRATION_WINDOW_SECONDS * sample_rate)
+    integrated = moving_average(squared, window_size, out=squared, work=work)
     
-    # moving average integration
-    window_size = int(0.15 * sample_rate)
-    integrated = np.convolve(squared, np.ones(window_size)/window_size, mode='same')
+    # One pass each for mean and mean square instead of np.mean + np.std
+    mean = integrated.mean()
+    variance = np.dot(integrated, integrated) / len(integrated) - mean * mean
+    threshold = mean + 0.5 * np.sqrt(max(variance, 0.0))
     
-    # find peaks
-    peaks = []
-    threshold = np.mean(integrated) + 0.5 * np.std(integrated)
+    # find peaks, at least min_distance apart (refractory period)
     min_distance = int(0.2 * sample_rate)
+    peaks, _ = signal.find_peaks(integrated, height=threshold, distance=min_distance)
+    
+    # Ignore peaks too close to the edges of the window
+    return peaks[(peaks >= min_distance) & (peaks < len(integrated) - min_distance)]
+
+class SerialReader(QtCore.QThread):
+    """Read samples from the serial port into a ring buffer off the GUI thread"""
+    samples_ready = QtCore.pyqtSignal(int, bool)
+    error = QtCore.pyqtSignal(str)
+    
+    def __init__(self, ser):
+        super().__init__()
+        self.serial = ser
+        self.running = True
+        self._rx_tail = b''
+        
+        # Ring buffer of the last MAX_POINTS 12-bit ADC samples, guarded by mutex
+        self.mutex = QtCore.QMutex()
+        self._buf = np.empty(MAX_POINTS, dtype=SAMPLE_DTYPE)
+        self._widx = 0
+        self._filled = 0
+        self._scratch = np.empty(MAX_POINTS, dtype=SAMPLE_DTYPE)
     
-    for i in range(min_distance, len(integrated) - min_distance):
-        if (integrated[i] > threshold and 
-            integrated[i] > integrated[i-1] and 
-            integrated[i] > integrated[i+1]):
+    def run(self):
+        """Read and parse serial data until stopped"""
+        while self.running:
+            try:
+                raw_data = self.serial.read(READ_CHUNK_SIZE)
+            except Exception as e:
+                self.error.emit(f"Serial read error: {str(e)}")
+                break
+            
+            if not raw_data:
+                self.msleep(READ_INTERVAL_MS)
+                continue
+            if self._rx_tail:
+                raw_data = self._rx_tail + raw_data
+            
+            # Keep a trailing partial line for the next read
+            end = raw_data.rfind(b'\n') + 1
+            self._rx_tail = raw_data[end:]
+            if len(self._rx_tail) > READ_CHUNK_SIZE:
+                # No line break in a full chunk, this isn't sample data
+                self._rx_tail = b''
+            if end == 0:
+                continue
+            samples = parse_samples(raw_data if end == len(raw_data) else raw_data[:end])
+            if len(samples) == 0:
+                continue
+            
+            lead_off_detected = bool(np.any(samples == -1))
+            samples = samples[samples >= 0]
+            if len(samples) > 0:
+                self.mutex.lock()
+                try:
+                    self.push_samples(samples)
+                finally:
+                    self.mutex.unlock()
             
-            start = max(0, i - min_distance//2)
-            end = min(len(integrated), i + min_distance//2)
-            if integrated[i] == max(integrated[start:end]):
-                peaks.append(i)
+            self.samples_ready.emit(len(samples), lead_off_detected)
     
-    return peaks
+    def stop(self):
+        """Stop reading and wait for the thread to finish"""
+        self.running = False
+        self.wait()
+    
+    def push_samples(self, values):
+        """Append a batch of samples to the ring buffer"""
+        n = len(values)
+        if n >= MAX_POINTS:
+            self._buf[:] = values[-MAX_POINTS:]
+            self._widx = 0
+        else:
+            end = self._widx + n
+            if end <= MAX_POINTS:
+                self._buf[self._widx:end] = values
+            else:
+                split = MAX_POINTS - self._widx
+                self._buf[self._widx:] = values[:split]
+                self._buf[:end - MAX_POINTS] = values[split:]
+            self._widx = end % MAX_POINTS
+        self._filled = min(self._filled + n, MAX_POINTS)
+    
+    def buffered_data(self):
+        """Return the buffered samples in chronological order
+
+        The result is a view into a reused scratch buffer, only valid until the next call.
+        """
+        self.mutex.lock()
+        try:
+            if self._filled < MAX_POINTS:
+                self._scratch[:self._filled] = self._buf[:self._filled]
+            else:
+                tail = MAX_POINTS - self._widx
+                self._scratch[:tail] = self._buf[self._widx:]
+                self._scratch[tail:] = self._buf[:self._widx]
+            return self._scratch[:self._filled]
+        finally:
+            self.mutex.unlock()
 
 class ECGApp(QtWidgets.QMainWindow):
     def __init__(self):
@@ -71,23 +215,40 @@ class ECGApp(QtWidgets.QMainWindow):
         
         # Setup variables
         self.serial = None
-        self.timer = QtCore.QTimer()
-        self.data_buffer = deque(maxlen=MAX_POINTS)
-        self.last_update_time = time.time()
-        self.data_count = 0
-        self.heart_rate_history = deque(maxlen=5)
+        self.reader = None
+        self.redraw_timer = QtCore.QTimer()
+        self.new_data_count = 0
+        self.lead_off_detected = False
+        self.has_new_data = False
+        self._samples_since_paint = 0
+        self._time_axis = np.arange(MAX_POINTS, dtype=np.float32) / SAMPLE_RATE
+        self._y_f32 = np.empty(MAX_POINTS, dtype=np.float32)
+        self.data_count = 0  # Samples since the last heart rate update
+        
+        # Recent heart rate readings with a running sum
+        self._hr_ring = np.zeros(HEART_RATE_HISTORY, dtype=np.int16)
+        self._hr_idx = 0
+        self._hr_count = 0
+        self._hr_sum = 0
+        
+        # Scratch buffers reused by every heart rate update
+        self._hr_scratch = np.empty(MAX_POINTS, dtype=np.float64)
+        self._hr_cumsum = np.empty(MAX_POINTS + int(INTEGRATION_WINDOW_SECONDS * SAMPLE_RATE), dtype=np.float64)
         
         self.setup_ui()
         
+        # Run the detector once so the first heart rate update doesn't stall the UI
+        pan_tompkins_detect(np.zeros(SAMPLE_RATE, dtype=SAMPLE_DTYPE), SAMPLE_RATE,
+                            self._hr_scratch, self._hr_cumsum)
+        
         # Connect signals
         self.refresh_button.clicked.connect(self.refresh_ports)
         self.connect_button.clicked.connect(self.toggle_connection)
-        self.timer.timeout.connect(self.update_plot)
+        self.redraw_timer.timeout.connect(self.update_plot)
         
-        self.refresh_ports()
+        pico_port = self.refresh_ports()
         
         # Auto-connect if Pico found
-        pico_port = find_pico_port()
         if pico_port:
             index = self.port_combo.findText(pico_port)
             if index >= 0:
@@ -114,12 +275,14 @@ class ECGApp(QtWidgets.QMainWindow):
         port_layout.addWidget(self.status_label)
         
         # Plot setup
-        pg.setConfigOptions(antialias=False)
+        pg.setConfigOptions(antialias=False, useOpenGL=True, enableExperimental=True)
         self.plot_widget = pg.PlotWidget()
         self.plot_widget.setLabel('left', 'Amplitude')
         self.plot_widget.setLabel('bottom', 'Time (s)')
         self.plot_widget.setRange(xRange=(0, DISPLAY_TIME_SECONDS), padding=0)
         self.plot_widget.setYRange(0, 4095)
+        self.plot_widget.setDownsampling(auto=True, mode='peak')
+        self.plot_widget.setClipToView(True)
         self.plot_curve = self.plot_widget.plot(pen=pg.mkPen('g', width=1.5))
         
         # Heart rate and signal quality indicators
@@ -131,8 +294,9 @@ class ECGApp(QtWidgets.QMainWindow):
         info_layout.addWidget(self.signal_quality_label)
         
         # Debug area
-        self.debug_text = QtWidgets.QTextEdit()
+        self.debug_text = QtWidgets.QPlainTextEdit()
         self.debug_text.setMaximumHeight(60)
+        self.debug_text.setMaximumBlockCount(200)
         self.debug_text.setReadOnly(True)
         
         layout.addLayout(port_layout)
@@ -142,25 +306,24 @@ class ECGApp(QtWidgets.QMainWindow):
     
     def log_debug(self, message):
         """Add debug message"""
-        self.debug_text.append(f"{time.strftime('%H:%M:%S')}: {message}")
-        self.debug_text.verticalScrollBar().setValue(
-            self.debug_text.verticalScrollBar().maximum()
-        )
+        # QPlainTextEdit keeps following the end when already scrolled to the bottom
+        self.debug_text.appendPlainText(f"{time.strftime('%H:%M:%S')}: {message}")
     
     def refresh_ports(self):
-        """Refresh available serial ports"""
+        """Refresh available serial ports, returning the Pico's port if found"""
         self.port_combo.clear()
-        ports = serial.tools.list_ports.comports()
+        ports = list(serial.tools.list_ports.comports())
         
         for port in ports:
             self.port_combo.addItem(port.device)
         
-        pico_port = find_pico_port()
+        pico_port = find_pico_port(ports)
         if pico_port:
             index = self.port_combo.findText(pico_port)
             if index >= 0:
                 self.port_combo.setCurrentIndex(index)
                 self.status_label.setText(f"Pico detected at {pico_port}")
+        return pico_port
     
     def toggle_connection(self):
         """Connect or disconnect from serial port"""
@@ -169,62 +332,74 @@ class ECGApp(QtWidgets.QMainWindow):
                 port = self.port_combo.currentText()
                 self.log_debug(f"Connecting to {port}")
                 
-                self.serial = serial.Serial(port, 115200, timeout=0.5)
+                self.serial = serial.Serial(port, 115200, timeout=0)
+                if hasattr(self.serial, 'set_buffer_size'):
+                    # Windows only, avoid driver buffer overruns between reads
+                    self.serial.set_buffer_size(rx_size=65536)
                 self.serial.reset_input_buffer()
                 
+                self.reader = SerialReader(self.serial)
+                self.reader.samples_ready.connect(self.on_samples)
+                self.reader.error.connect(self.log_debug)
+                
                 self.status_label.setText(f"Connected: {port}")
                 self.connect_button.setText("Disconnect")
                 
                 # Reset data
-                self.data_buffer.clear()
+                self.new_data_count = 0
+                self.lead_off_detected = False
+                self.has_new_data = False
+                self._samples_since_paint = 0
                 self.data_count = 0
-                self.heart_rate_history.clear()
+                self._hr_ring.fill(0)
+                self._hr_idx = 0
+                self._hr_count = 0
+                self._hr_sum = 0
                 
-                self.timer.start(UPDATE_INTERVAL_MS)
-                self.last_update_time = time.time()
+                self.reader.start()
+                self.redraw_timer.start(REDRAW_INTERVAL_MS)
                 
             except Exception as e:
                 self.log_debug(f"Connection error: {str(e)}")
                 self.status_label.setText(f"Error: {str(e)}")
+                
+                # Don't leave a half-opened port behind
+                self.redraw_timer.stop()
+                if self.reader is not None:
+                    self.reader.stop()
+                    self.reader = None
+                if self.serial is not None:
+                    self.serial.close()
+                    self.serial = None
+                self.connect_button.setText("Connect")
         else:
-            self.timer.stop()
+            self.redraw_timer.stop()
+            if self.reader is not None:
+                self.reader.stop()
+                self.reader = None
             self.serial.close()
             self.serial = None
             self.status_label.setText("Disconnected")
             self.connect_button.setText("Connect")
     
+    def on_samples(self, count, lead_off):
+        """Collect samples reported by the serial reader"""
+        self.new_data_count += count
+        self.lead_off_detected = self.lead_off_detected or lead_off
+        self.has_new_data = True
+    
     def update_plot(self):
         """Update plot with new data"""
-        if not self.serial or not self.serial.is_open:
+        if self.reader is None or not self.has_new_data:
             return
-            
-        bytes_waiting = self.serial.in_waiting
-        if bytes_waiting <= 0:
-            return
-            
+        
+        new_data_count = self.new_data_count
+        lead_off_detected = self.lead_off_detected
+        self.new_data_count = 0
+        self.lead_off_detected = False
+        self.has_new_data = False
+        
         try:
-            raw_data = self.serial.read(bytes_waiting)
-            lines = raw_data.decode('utf-8', errors='replace').strip().split('\n')
-            
-            new_data_count = 0
-            lead_off_detected = False
-            
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-                    
-                try:
-                    value = int(line)
-                    
-                    if value == -1:
-                        lead_off_detected = True
-                    else:
-                        self.data_buffer.append(value)
-                        new_data_count += 1
-                except ValueError:
-                    continue
-            
             # Update signal quality indicator
             if lead_off_detected:
                 self.signal_quality_label.setText("Signal Quality: Lead Off")
@@ -235,21 +410,28 @@ class ECGApp(QtWidgets.QMainWindow):
             
             if new_data_count > 0:
                 self.data_count += new_data_count
+                self._samples_since_paint += new_data_count
                 
-                data_array = np.array(self.data_buffer)
-                time_values = np.linspace(0, len(data_array) / SAMPLE_RATE, len(data_array))
-                self.plot_curve.setData(time_values, data_array)
+                # Skip the redraw until at least a pixel's worth of samples arrived
+                samples_per_pixel = max(1, MAX_POINTS // max(1, self.plot_widget.width()))
+                paint = self._samples_since_paint >= samples_per_pixel
+                update_hr = self.data_count >= SAMPLE_RATE
+                if not (paint or update_hr):
+                    return
                 
-                # Calculate stats once per second
-                now = time.time()
-                elapsed = now - self.last_update_time
+                data_array = self.reader.buffered_data()
+                n = len(data_array)
+                if paint:
+                    np.copyto(self._y_f32[:n], data_array)
+                    self.plot_curve.setData(x=self._time_axis[:n], y=self._y_f32[:n])
+                    self._samples_since_paint = 0
                 
-                if elapsed >= 1.0:
-                    if not lead_off_detected and len(data_array) >= SAMPLE_RATE:
+                # Calculate stats once per second of samples
+                if update_hr:
+                    if not lead_off_detected and n >= SAMPLE_RATE:
                         self.update_heart_rate(data_array)
                     
                     self.data_count = 0
-                    self.last_update_time = now
         
         except Exception as e:
             self.log_debug(f"Error: {str(e)}")
@@ -257,19 +439,22 @@ class ECGApp(QtWidgets.QMainWindow):
     def update_heart_rate(self, data):
         """Calculate heart rate using Pan-Tompkins algorithm"""
         try:
-            peaks = pan_tompkins_detect(data, SAMPLE_RATE)
+            peaks = pan_tompkins_detect(data, SAMPLE_RATE, self._hr_scratch, self._hr_cumsum)
             
             if len(peaks) >= 2:
                 # Calculate RR intervals
-                intervals = [peaks[i+1] - peaks[i] for i in range(len(peaks)-1)]
+                intervals = np.diff(peaks)
                 
                 # Convert to time and calculate heart rate
-                avg_interval_sec = np.mean(intervals) / SAMPLE_RATE
+                avg_interval_sec = intervals.mean() / SAMPLE_RATE
                 heart_rate = int(60 / avg_interval_sec)
                 
                 if MIN_HEART_RATE <= heart_rate <= MAX_HEART_RATE:
-                    self.heart_rate_history.append(heart_rate)
-                    avg_hr = int(sum(self.heart_rate_history) / len(self.heart_rate_history))
+                    self._hr_sum += heart_rate - int(self._hr_ring[self._hr_idx])
+                    self._hr_ring[self._hr_idx] = heart_rate
+                    self._hr_idx = (self._hr_idx + 1) % HEART_RATE_HISTORY
+                    self._hr_count = min(self._hr_count + 1, HEART_RATE_HISTORY)
+                    avg_hr = self._hr_sum // self._hr_count
                     
                     self.hr_label.setText(f"Heart Rate: {avg_hr} BPM")
                     
@@ -289,6 +474,8 @@ class ECGApp(QtWidgets.QMainWindow):
     
     def closeEvent(self, event):
         """Clean up on exit"""
+        if self.reader is not None:
+            self.reader.stop()
         if self.serial and self.serial.is_open:
             self.serial.close()
         event.accept()